@@ -2,7 +2,14 @@
 openedx_filters_samples Django application initialization.
 """
 
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from openedx_filters_samples.bulk import (
+    buffer_profile_meta_on_request_started,
+    flush_profile_meta_on_request_finished,
+)
 
 
 class OpenedxFiltersSamplesConfig(AppConfig):
@@ -11,3 +18,21 @@ class OpenedxFiltersSamplesConfig(AppConfig):
     """
 
     name = 'openedx_filters_samples'
+
+    def ready(self):
+        """
+        Set up the batched writer and cache invalidation used by the filter steps.
+        """
+        from openedx_filters_samples.samples.pipeline import (  # pylint: disable=import-outside-toplevel
+            invalidate_custom_template,
+            invalidate_previous_custom_template,
+        )
+
+        request_started.connect(buffer_profile_meta_on_request_started)
+        request_finished.connect(flush_profile_meta_on_request_finished)
+
+        # The certificates app is only installed in the LMS.
+        if apps.is_installed("lms.djangoapps.certificates"):
+            pre_save.connect(invalidate_previous_custom_template, sender="certificates.CertificateTemplate")
+            post_save.connect(invalidate_custom_template, sender="certificates.CertificateTemplate")
+            post_delete.connect(invalidate_custom_template, sender="certificates.CertificateTemplate")
@@ -0,0 +1,262 @@
+"""
+Batched writer for user profile meta updates.
+
+Filter steps enqueue the meta keys they want to store instead of saving the
+profile inside the request. Updates are keyed by user id, so the steps don't
+load the profile either. Updates are only queued once the current transaction
+commits. The ones queued while serving a request are buffered for that request
+and persisted with a single bulk UPDATE when it finishes, and a background
+thread flushes anything queued outside of a request.
+
+Queued keys are merged into the existing profile meta, and the write happens
+after the step returns, so readers may briefly see the previous values.
+Updates are kept in memory only: anything still pending when the worker
+process recycles or shuts down is lost.
+"""
+import logging
+import threading
+import time
+from functools import partial
+from itertools import islice
+
+from django.apps import apps
+from django.db import close_old_connections, transaction
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.05
+MAX_BATCH_SIZE = 500
+WRITER_IDLE_TIMEOUT = 60
+MAX_RETRY_DELAY = 60
+MAX_ATTEMPTS = 5
+
+# Pending meta updates by user id, and the failed write attempts of each user.
+# Both are guarded by _lock.
+_pending = {}
+_attempts = {}
+_lock = threading.Lock()
+_pending_changed = threading.Condition(_lock)
+_writer = None  # pylint: disable=invalid-name
+
+# Updates buffered for the request being served by the current thread.
+_request = threading.local()
+
+
+def queue_profile_meta(user_id, meta):
+    """
+    Schedule `meta` to be merged into the profile meta of the user `user_id`.
+
+    Updates are keyed by user so callers don't need to load the profile. The
+    update is discarded if the current transaction is rolled back.
+    """
+    transaction.on_commit(partial(_queue_committed_profile_meta, user_id, meta))
+
+
+def _queue_committed_profile_meta(user_id, meta):
+    """
+    Add `meta` to the updates of the current request, or to the writer thread ones.
+    """
+    updates = getattr(_request, "updates", None)
+    if updates is not None:
+        updates.setdefault(user_id, {}).update(meta)
+        return
+
+    with _lock:
+        _pending.setdefault(user_id, {}).update(meta)
+        _pending_changed.notify()
+    if _writer is None or not _writer.is_alive():
+        # Threads don't survive a fork, so workers start their own writer.
+        start_profile_writer()
+
+
+def flush_profile_meta(max_items=MAX_BATCH_SIZE):
+    """
+    Persist the pending profile meta updates of up to `max_items` users.
+
+    Each profile is written once per batch, and profiles whose meta already
+    holds the values are not written at all. Profiles locked by another
+    transaction are queued again and retried on the next flush. If the write
+    fails, the whole batch is queued again before the error is raised.
+
+    Returns the number of profiles updated.
+    """
+    updates = _take_pending(max_items)
+    if not updates:
+        return 0
+
+    try:
+        return _write_profile_meta(updates)
+    except Exception:
+        _requeue(updates)
+        raise
+
+
+def _take_pending(max_items):
+    """
+    Remove and return the pending updates of up to `max_items` users.
+    """
+    with _lock:
+        return {user_id: _pending.pop(user_id) for user_id in list(islice(_pending, max_items))}
+
+
+def _requeue(updates):
+    """
+    Put `updates` back in the pending updates.
+
+    Values queued since `updates` were taken are newer, so they take precedence.
+    """
+    with _lock:
+        for user_id, meta in updates.items():
+            _pending[user_id] = {**meta, **_pending.get(user_id, {})}
+        _pending_changed.notify()
+    start_profile_writer()
+
+
+def _write_profile_meta(updates):
+    """
+    Merge `updates` into the profile meta of their users with one bulk UPDATE.
+
+    Returns the number of profiles updated.
+    """
+    UserProfile = apps.get_model("student", "UserProfile")  # pylint: disable=invalid-name
+    locked = dict(updates)
+    with transaction.atomic():
+        profiles = list(UserProfile.objects.select_for_update(skip_locked=True).filter(user_id__in=updates))
+        changed = []
+        for profile in profiles:
+            meta = locked.pop(profile.user_id, None)
+            if meta is None:
+                continue
+            profile_meta = profile.get_meta()
+            if meta.items() <= profile_meta.items():
+                continue
+            profile_meta.update(meta)
+            profile.set_meta(profile_meta)
+            changed.append(profile)
+        if changed:
+            UserProfile.objects.bulk_update(changed, ["meta"])
+
+    if locked:
+        # Profiles missing from the locked rows are either locked or deleted.
+        existing = UserProfile.objects.filter(user_id__in=locked).values_list("user_id", flat=True)
+        _requeue({user_id: locked[user_id] for user_id in existing})
+
+    return len(changed)
+
+
+def _write_or_retry_later(updates):
+    """
+    Write `updates`, queueing again the ones that fail.
+
+    When a batch fails, its updates are written one by one so a single bad
+    update doesn't hold back the rest. Each failure counts as an attempt, and
+    updates are dropped after `MAX_ATTEMPTS` failed attempts.
+
+    Returns whether all the updates were written.
+    """
+    try:
+        _write_profile_meta(updates)
+    except Exception:  # pylint: disable=broad-except
+        if len(updates) > 1:
+            log.warning("Failed to write %d profile meta updates, retrying them one by one.", len(updates))
+            written = [_write_or_retry_later({user_id: meta}) for user_id, meta in updates.items()]
+            return all(written)
+        _retry_later(updates)
+        return False
+
+    with _lock:
+        for user_id in updates:
+            _attempts.pop(user_id, None)
+    return True
+
+
+def _retry_later(updates):
+    """
+    Queue again the failed `updates`, dropping the ones out of attempts.
+
+    Must be called while handling the write error, which is logged with the
+    dropped updates.
+    """
+    retry = {}
+    with _lock:
+        for user_id, meta in updates.items():
+            attempts = _attempts.get(user_id, 0) + 1
+            if attempts < MAX_ATTEMPTS:
+                _attempts[user_id] = attempts
+                retry[user_id] = meta
+                continue
+            del _attempts[user_id]
+            log.exception(
+                "Dropping the profile meta update of user %s after %d failed attempts: %s.", user_id, attempts, meta
+            )
+    if retry:
+        _requeue(retry)
+
+
+def buffer_profile_meta_on_request_started(sender, **kwargs):  # pylint: disable=unused-argument
+    """
+    Start buffering the profile meta updates queued while serving the request.
+    """
+    _request.updates = {}
+
+
+def flush_profile_meta_on_request_finished(sender, **kwargs):  # pylint: disable=unused-argument
+    """
+    Persist the profile meta updates queued while serving the request.
+
+    `request_finished` is sent once the response has been closed, so the write
+    doesn't add latency to the response itself. Receivers of that signal are
+    not isolated from the response close, so errors are logged instead of
+    raised and the failed updates are left to the writer thread.
+    """
+    updates = getattr(_request, "updates", None)
+    _request.updates = None
+    if not updates:
+        return
+    try:
+        _write_profile_meta(updates)
+    except Exception:  # pylint: disable=broad-except
+        log.exception("Failed to write the profile meta updates of the request, retrying them in the background.")
+        _requeue(updates)
+
+
+def start_profile_writer():
+    """
+    Start the background thread that flushes pending profile meta updates.
+    """
+    global _writer  # pylint: disable=global-statement
+    with _lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run_writer, name="profile-meta-writer", daemon=True)
+            _writer.start()
+
+
+def _run_writer():
+    """
+    Flush pending profile meta updates as they are queued.
+
+    The thread waits for updates, so it doesn't wake up while there is nothing
+    to write, and exits after `WRITER_IDLE_TIMEOUT` idle seconds.
+    `queue_profile_meta` starts it again when needed. After a failed write,
+    the delay before the next one doubles, up to `MAX_RETRY_DELAY` seconds.
+    """
+    global _writer  # pylint: disable=global-statement
+    delay = FLUSH_INTERVAL
+    while True:
+        with _lock:
+            if not _pending:
+                _pending_changed.wait(WRITER_IDLE_TIMEOUT)
+            if not _pending:
+                _writer = None
+                return
+
+        # Give the updates queued right after the first one the chance to join the batch.
+        time.sleep(delay)
+        updates = _take_pending(MAX_BATCH_SIZE)
+        if not updates:
+            continue
+        close_old_connections()
+        if _write_or_retry_later(updates):
+            delay = FLUSH_INTERVAL
+        else:
+            delay = min(delay * 2, MAX_RETRY_DELAY)
@@ -3,8 +3,22 @@ Filters steps exemplifying how to:
     - Modify filter input
     - No operation
     - Halt process
+
+Steps that modify a dict argument, such as form_data or context, update it in
+place and also return it, so the caller's object already reflects the change.
+
+These steps are I/O-bound: their cost is in database queries and writes,
+not in Python computation. Optimize them by reducing query counts (see
+`openedx_filters_samples.bulk`), not by adding JIT compilation.
 """
+import re
+from functools import lru_cache
+from operator import attrgetter
+
+from django.core.cache import cache
+from django.db.models import QuerySet
 from django.http import HttpResponse
+from opaque_keys.edx.keys import CourseKey
 from openedx_filters import PipelineStep
 from openedx_filters.learning.filters import (
     AccountSettingsRenderStarted,
@@ -20,6 +34,92 @@ from openedx_filters.learning.filters import (
     StudentRegistrationRequested,
 )
 
+from openedx_filters_samples.bulk import queue_profile_meta
+
+try:
+    from lms.djangoapps.certificates.models import CertificateTemplate
+except ImportError:
+    # Only available when installed in the LMS.
+    CertificateTemplate = None
+
+# Results returned as-is by several steps. The filters runner only reads them
+# to update its own kwargs, so they are shared instead of rebuilt per call and
+# must never be mutated.
+_EMPTY = {}
+_HONOR = {"mode": "honor"}
+
+# Result of ModifyCertificateModeBeforeCreation for each certificate mode it changes.
+_CERTIFICATE_MODE_CHANGES = {"honor": {"mode": "no-id-professional"}}
+
+# Already encoded so HttpResponse doesn't encode the bodies on every call.
+_CUSTOM_RESPONSE_BODY = b"Here's the text of the web page."
+_CUSTOM_DASHBOARD_RESPONSE_BODY = b"This is a custom response."
+
+TEMPLATE_HTML = """
+    <%namespace name='static' file='static_content.html'/>
+    <html>
+    <body>
+        lang: ${LANGUAGE_CODE}
+        course name: ${accomplishment_copy_course_name}
+        mode: ${course_mode}
+        ${accomplishment_copy_course_description}
+        ${twitter_url}
+        <img class="custom-logo" src="test-logo.png" />
+    </body>
+    </html>
+"""
+
+
+def _custom_template_cache_key(course_key):
+    """
+    Return the cache key of the custom certificate template of `course_key`.
+    """
+    return f"openedx_filters_samples.custom_template.{course_key}"
+
+
+def invalidate_custom_template(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Drop the cached custom certificate template of the course of a template saved or deleted.
+    """
+    cache.delete(_custom_template_cache_key(instance.course_key))
+
+
+def invalidate_previous_custom_template(sender, instance, **kwargs):
+    """
+    Drop the cached custom certificate template of the course a template is moved away from.
+    """
+    if instance.pk is None:
+        return
+    moved = sender.objects.filter(pk=instance.pk).exclude(course_key=instance.course_key)
+    cache.delete_many(
+        [_custom_template_cache_key(course_key) for course_key in moved.values_list("course_key", flat=True)]
+    )
+
+
+_enrollment_org = attrgetter("course_id.org")
+
+
+def _exclude_org_enrollments(enrollments, org):
+    """
+    Return `enrollments` without the ones in courses of `org`.
+
+    Querysets are filtered by the database so the excluded rows are never
+    fetched, anything else is filtered in Python. Both compare the org case
+    sensitively: the queryset uses a regex lookup because `exact` follows the
+    column collation, which is case-insensitive by default on MySQL.
+    """
+    if isinstance(enrollments, QuerySet):
+        return enrollments.exclude(course__org__regex=f"^{re.escape(org)}$")
+    return [enrollment for enrollment in enrollments if _enrollment_org(enrollment) != org]
+
+
+@lru_cache(maxsize=4096)
+def _parse_course_key(course_id):
+    """
+    Return the CourseKey for `course_id`, reusing keys already parsed.
+    """
+    return CourseKey.from_string(course_id)
+
 
 class StopCertificateCreation(PipelineStep):
     """
@@ -51,8 +151,7 @@ class ModifyUsernameBeforeRegistration(PipelineStep):
         }
     """
     def run_filter(self, form_data, *args, **kwargs):  # pylint: disable=arguments-differ
-        username = f"{form_data.get('username')}-modified"
-        form_data["username"] = username
+        form_data["username"] = form_data["username"] + "-modified"
         return {
             "form_data": form_data,
         }
@@ -62,6 +161,8 @@ class ModifyUserProfileBeforeLogin(PipelineStep):
     """
     Add previous_login field to the user's profile.
 
+    The update is written in the background and can be lost, see `openedx_filters_samples.bulk`.
+
     Example usage:
 
     Add the following configurations to your configuration file:
@@ -76,8 +177,8 @@ class ModifyUserProfileBeforeLogin(PipelineStep):
         }
     """
     def run_filter(self, user, *args, **kwargs):  # pylint: disable=arguments-differ
-        user.profile.set_meta({"previous_login": str(user.last_login)})
-        user.profile.save()
+        previous_login = user.last_login.isoformat(timespec="seconds") if user.last_login else ""
+        queue_profile_meta(user.id, {"previous_login": previous_login})
         return {"user": user}
 
 
@@ -99,9 +200,7 @@ class ModifyModeBeforeEnrollment(PipelineStep):
         }
     """
     def run_filter(self, user, course_key, mode, *args, **kwargs):  # pylint: disable=arguments-differ, unused-argument
-        return {
-            "mode": "honor",
-        }
+        return _HONOR
 
 
 class ModifyCertificateModeBeforeCreation(PipelineStep):
@@ -121,12 +220,8 @@ class ModifyCertificateModeBeforeCreation(PipelineStep):
             }
         }
     """
-    def run_filter(self, user, course_id, mode, status, *args, **kwargs):  # pylint: disable=arguments-differ
-        if mode == 'honor':
-            return {
-                'mode': 'no-id-professional',
-            }
-        return {}
+    def run_filter(self, user, course_key, mode, status, *args, **kwargs):  # pylint: disable=arguments-differ
+        return _CERTIFICATE_MODE_CHANGES.get(mode, _EMPTY)
 
 
 class ModifyContextBeforeRender(PipelineStep):
@@ -157,6 +252,8 @@ class ModifyUserProfileBeforeUnenrollment(PipelineStep):
     """
     Add unenrolled_from field to the user's profile.
 
+    The update is written in the background and can be lost, see `openedx_filters_samples.bulk`.
+
     Example usage:
 
     Add the following configurations to your configuration file:
@@ -171,15 +268,16 @@ class ModifyUserProfileBeforeUnenrollment(PipelineStep):
         }
     """
     def run_filter(self, enrollment, *args, **kwargs):  # pylint: disable=arguments-differ
-        enrollment.user.profile.set_meta({"unenrolled_from": str(enrollment.course_id)})
-        enrollment.user.profile.save()
-        return {}
+        queue_profile_meta(enrollment.user_id, {"unenrolled_from": str(enrollment.course_id)})
+        return _EMPTY
 
 
 class ModifyUserProfileBeforeCohortChange(PipelineStep):
     """
     Add cohort_info field to the user's profile.
 
+    The update is written in the background and can be lost, see `openedx_filters_samples.bulk`.
+
     Example usage:
 
     Add the following configurations to your configuration file:
@@ -194,14 +292,9 @@ class ModifyUserProfileBeforeCohortChange(PipelineStep):
         }
     """
     def run_filter(self, current_membership, target_cohort, *args, **kwargs):  # pylint: disable=arguments-differ
-        user = current_membership.user
-        user.profile.set_meta(
-            {
-                "cohort_info": f"Changed from Cohort {str(current_membership.course_user_group)} to Cohort {str(target_cohort)}"  # pylint: disable=line-too-long
-            }
-        )
-        user.profile.save()
-        return {}
+        cohort_info = f"Changed from Cohort {current_membership.course_user_group} to Cohort {target_cohort}"
+        queue_profile_meta(current_membership.user_id, {"cohort_info": cohort_info})
+        return _EMPTY
 
 
 class NoopFilter(PipelineStep):
@@ -223,7 +316,7 @@ class NoopFilter(PipelineStep):
     """
 
     def run_filter(self, *args, **kwargs):
-        return {}
+        return _EMPTY
 
 
 class StopEnrollment(PipelineStep):
@@ -360,7 +453,7 @@ class RenderCustomResponseCertificate(PipelineStep):
     """
 
     def run_filter(self, context, custom_template, *args, **kwargs):  # pylint: disable=arguments-differ
-        response = HttpResponse("Here's the text of the web page.")
+        response = HttpResponse(_CUSTOM_RESPONSE_BODY)
         raise CertificateRenderStarted.RenderCustomResponse(
             "You can't generate a certificate from this site.",
             response=response,
@@ -411,14 +504,14 @@ class RenderResponseCourseAbout(PipelineStep):
         }
     """
 
-    def run_filter(self, context, custom_template, *args, **kwargs):  # pylint: disable=arguments-differ
+    def run_filter(self, context, template_name, *args, **kwargs):  # pylint: disable=arguments-differ
         """
         Pipeline step that redirects to the course survey.
 
         When raising the exception, this filter uses a redirect_to field handled by
         the course about view that redirects to the URL indicated.
         """
-        response = HttpResponse("Here's the text of the web page.")
+        response = HttpResponse(_CUSTOM_RESPONSE_BODY)
 
         raise CourseAboutRenderStarted.RenderCustomResponse(
             "You can't access this courses home page, redirecting to the correct location.",
@@ -513,7 +606,7 @@ class ModifyUpdatesFromCourse(PipelineStep):
         if update_message:
             update_message.content = "<p>This is a simple message</p>"
         return {
-            "context": context, template_name: template_name,
+            "context": context, "template_name": template_name,
         }
 
 
@@ -583,7 +676,7 @@ class RenderCustomDashboardResponse(PipelineStep):
         }
     """
     def run_filter(self, context, template_name, *args, **kwargs):  # pylint: disable=arguments-differ
-        response = HttpResponse("This is a custom response.")
+        response = HttpResponse(_CUSTOM_DASHBOARD_RESPONSE_BODY)
         raise DashboardRenderStarted.RenderCustomResponse(
             "You can't see this site's dashboard.",
             response=response,
@@ -612,11 +705,9 @@ class FilterEnrollmentDashboard(PipelineStep):
                 }
             }
         """
-        context["course_enrollments"] = [
-            course for course in context["course_enrollments"] if course.course_id.org != "edX"
-        ]
+        context["course_enrollments"] = _exclude_org_enrollments(context["course_enrollments"], "edX")
         return {
-            "context": context, template_name: template_name,
+            "context": context, "template_name": template_name,
         }
 
 
@@ -643,45 +734,36 @@ class RenderCustomCertificateStep(PipelineStep):
         Pipeline steps that gets or creates a new custom template to render instead
         of the original.
         """
-        from opaque_keys.edx.keys import CourseKey  # pylint: disable=import-outside-toplevel
-
-        course_key = CourseKey.from_string(context["course_id"])
+        course_key = _parse_course_key(context["course_id"])
         custom_template = self._get_or_create_custom_template(mode='honor', course_key=course_key)
         return {"custom_template": custom_template}
 
     def _get_or_create_custom_template(self, org_id=None, mode=None, course_key=None, language=None):
         """
-        Creates a custom certificate template entry in DB.
-        """
-        from lms.djangoapps.certificates.models import CertificateTemplate  # pylint: disable=E0401, C0415
-
-        template_html = """
-            <%namespace name='static' file='static_content.html'/>
-            <html>
-            <body>
-                lang: ${LANGUAGE_CODE}
-                course name: ${accomplishment_copy_course_name}
-                mode: ${course_mode}
-                ${accomplishment_copy_course_description}
-                ${twitter_url}
-                <img class="custom-logo" src="test-logo.png" />
-            </body>
-            </html>
+        Gets or creates a custom certificate template entry in DB.
+
+        Any template of the course is reused, the given organization, mode and
+        language are only used when creating one. Templates are cached until
+        they are saved or deleted again, see `invalidate_custom_template`.
         """
-        template = CertificateTemplate.objects.filter(course_key=course_key)
-        if bool(template):
-            return template.first()
-
-        template = CertificateTemplate(
-            name='custom template',
-            template=template_html,
-            organization_id=org_id,
-            course_key=course_key,
-            mode=mode,
-            is_active=True,
-            language=language
-        )
-        template.save()
+        cache_key = _custom_template_cache_key(course_key)
+        template = cache.get(cache_key)
+        if template is None:
+            try:
+                template, _ = CertificateTemplate.objects.get_or_create(
+                    course_key=course_key,
+                    defaults={
+                        "name": "custom template",
+                        "template": TEMPLATE_HTML,
+                        "organization_id": org_id,
+                        "mode": mode,
+                        "is_active": True,
+                        "language": language,
+                    },
+                )
+            except CertificateTemplate.MultipleObjectsReturned:
+                template = CertificateTemplate.objects.filter(course_key=course_key).first()
+            cache.set(cache_key, template)
         return template
 
 
@@ -750,7 +832,7 @@ class StaffViewCourseAbout(PipelineStep):
         context["staff_access"] = True
         context["studio_url"] = "http://studio.com"
         return {
-            "context": context, template_name: template_name,
+            "context": context, "template_name": template_name,
         }
 
 
@@ -801,7 +883,6 @@ class CourseEnrollmentsQsPipelineStep(PipelineStep):
 
     def run_filter(self, enrollments):  # pylint: disable=arguments-differ
         """Pipeline steps that modifies course enrollments when make a queryset request."""
-        enrollments = [ enrollment for enrollment in enrollments if enrollment.course_id.org != "edX" ]
         return {
-            "enrollments": enrollments,
+            "enrollments": _exclude_org_enrollments(enrollments, "edX"),
         }
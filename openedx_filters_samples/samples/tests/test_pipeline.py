@@ -2,40 +2,109 @@
 Test cases for Open edX Filters steps samples.
 """
 from datetime import datetime
-from unittest.mock import MagicMock
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.exceptions import MultipleObjectsReturned
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, override_settings
 from opaque_keys.edx.keys import CourseKey
 from openedx_filters.learning.filters import (
+    CertificateCreationRequested,
+    CertificateRenderStarted,
+    CohortChangeRequested,
+    CourseAboutRenderStarted,
     CourseEnrollmentStarted,
+    CourseUnenrollmentStarted,
+    DashboardRenderStarted,
     StudentLoginRequested,
     StudentRegistrationRequested,
 )
 
+from openedx_filters_samples.samples.pipeline import (
+    CourseEnrollmentsQsPipelineStep,
+    invalidate_custom_template,
+    invalidate_previous_custom_template,
+)
+
 
-class SampleStepsTestCase(TestCase):
+class SampleStepsTestCase(SimpleTestCase):
     """
-    Samples steps test cases.
+    Base test case with the data shared by the samples steps test cases.
     """
 
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.course_key = CourseKey.from_string("course-v1:Demo+DemoX+Demo_Course")
+
     def setUp(self):
         super().setUp()
         self.user = MagicMock(username="test_username", last_login=datetime.now())
         self.registration_form = {
             "username": "test_username",
         }
-        self.course_key = CourseKey.from_string("course-v1:Demo+DemoX+Demo_Course")
-
-    @override_settings(
-        OPEN_EDX_FILTERS_CONFIG={
-            "org.openedx.learning.student.registration.requested.v1": {
-                "fail_silently": False,
-                "pipeline": [
-                    "openedx_filters_samples.samples.pipeline.ModifyUsernameBeforeRegistration"
-                ]
-            }
-        }
-    )
+
+
+@override_settings(
+    OPEN_EDX_FILTERS_CONFIG={
+        "org.openedx.learning.student.registration.requested.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.ModifyUsernameBeforeRegistration"
+            ]
+        },
+        "org.openedx.learning.student.login.requested.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.ModifyUserProfileBeforeLogin"
+            ]
+        },
+        "org.openedx.learning.course.enrollment.started.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.ModifyModeBeforeEnrollment"
+            ]
+        },
+        "org.openedx.learning.course.unenrollment.started.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.ModifyUserProfileBeforeUnenrollment"
+            ]
+        },
+        "org.openedx.learning.cohort.change.requested.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.ModifyUserProfileBeforeCohortChange"
+            ]
+        },
+        "org.openedx.learning.certificate.creation.requested.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.ModifyCertificateModeBeforeCreation"
+            ]
+        },
+        "org.openedx.learning.dashboard.render.started.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.FilterEnrollmentDashboard"
+            ]
+        },
+        "org.openedx.learning.course_about.render.started.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.ModifyUpdatesFromCourse",
+                "openedx_filters_samples.samples.pipeline.StaffViewCourseAbout",
+            ]
+        },
+    }
+)
+class ModifyingStepsTestCase(SampleStepsTestCase):
+    """
+    Test cases for the samples steps that modify the filter arguments.
+    """
+
     def test_modify_username(self):
         """
         Test that the user's username is modified before registration.
@@ -48,98 +117,223 @@ class SampleStepsTestCase(TestCase):
 
         self.assertDictEqual(expected_result, result)
 
-    @override_settings(
-        OPEN_EDX_FILTERS_CONFIG={
-            "org.openedx.learning.student.registration.requested.v1": {
-                "fail_silently": False,
-                "pipeline": [
-                    "openedx_filters_samples.samples.pipeline.StopRegister"
-                ]
-            }
-        }
-    )
-    def test_stop_registration(self):
+    @patch("openedx_filters_samples.samples.pipeline.queue_profile_meta")
+    def test_modify_user_profile(self, queue_profile_meta):
         """
-        Test that the user's registration stops.
+        Test that the user's previous login is queued to be stored in the profile.
         """
-        with self.assertRaises(StudentRegistrationRequested.PreventRegistration):
-            StudentRegistrationRequested.run_filter(form_data=self.registration_form)
+        StudentLoginRequested.run_filter(user=self.user)
 
-    @override_settings(
-        OPEN_EDX_FILTERS_CONFIG={
-            "org.openedx.learning.student.login.requested.v1": {
-                "fail_silently": False,
-                "pipeline": [
-                    "openedx_filters_samples.samples.pipeline.ModifyUserProfileBeforeLogin"
-                ]
-            }
-        }
-    )
-    def test_modify_user_profile(self):
+        queue_profile_meta.assert_called_once_with(
+            self.user.id,
+            {
+                "previous_login": self.user.last_login.isoformat(timespec="seconds"),
+            },
+        )
+        self.user.profile.get_meta.assert_not_called()
+        self.user.profile.save.assert_not_called()
+
+    def test_modify_enrollment_mode(self):
         """
-        Test that the user's username is modified before registration.
+        Test that the enrollment mode is modified before the enrollment process.
+        """
+        expected_result = (
+            self.user,
+            self.course_key,
+            "honor",
+        )
+
+        result = CourseEnrollmentStarted.run_filter(
+            user=self.user, course_key=self.course_key, mode="audit",
+        )
+
+        self.assertTupleEqual(expected_result, result)
+
+    @patch("openedx_filters_samples.samples.pipeline.queue_profile_meta")
+    def test_modify_user_profile_before_unenrollment(self, queue_profile_meta):
         """
-        user = StudentLoginRequested.run_filter(user=self.user)
+        Test that the unenrolled course is queued to be stored in the user's profile.
+        """
+        enrollment = MagicMock(user_id=self.user.id, course_id=self.course_key)
+
+        CourseUnenrollmentStarted.run_filter(enrollment=enrollment)
 
-        user.profile.set_meta.assert_called_once_with(
+        queue_profile_meta.assert_called_once_with(
+            self.user.id,
             {
-                "previous_login": str(self.user.last_login),
-            }
+                "unenrolled_from": str(self.course_key),
+            },
         )
 
-    @override_settings(
-        OPEN_EDX_FILTERS_CONFIG={
-            "org.openedx.learning.student.login.requested.v1": {
-                "fail_silently": False,
-                "pipeline": [
-                    "openedx_filters_samples.samples.pipeline.StopLogin"
-                ]
-            }
-        }
-    )
-    def test_stop_login(self):
+    @patch("openedx_filters_samples.samples.pipeline.queue_profile_meta")
+    def test_modify_user_profile_before_cohort_change(self, queue_profile_meta):
         """
-        Test that the user's login stops.
+        Test that the cohort change is queued to be stored in the user's profile.
         """
-        with self.assertRaises(StudentLoginRequested.PreventLogin):
-            StudentLoginRequested.run_filter(user=self.user)
+        current_membership = MagicMock(user_id=self.user.id, course_user_group="Default Group")
 
-    @override_settings(
-        OPEN_EDX_FILTERS_CONFIG={
-            "org.openedx.learning.course.enrollment.started.v1": {
-                "fail_silently": False,
-                "pipeline": [
-                    "openedx_filters_samples.samples.pipeline.ModifyModeBeforeEnrollment"
-                ]
-            }
-        }
-    )
-    def test_modify_enrollment_mode(self):
+        CohortChangeRequested.run_filter(current_membership=current_membership, target_cohort="Target Group")
+
+        queue_profile_meta.assert_called_once_with(
+            self.user.id,
+            {
+                "cohort_info": "Changed from Cohort Default Group to Cohort Target Group",
+            },
+        )
+
+    def test_modify_certificate_mode(self):
         """
-        Test that the enrollment mode is modified before the enrollment process.
+        Test that honor certificates are created as no-id-professional ones.
         """
         expected_result = (
             self.user,
             self.course_key,
-            "honor",
+            "no-id-professional",
+            "downloadable",
+            1.0,
+            "batch",
         )
 
-        result = CourseEnrollmentStarted.run_filter(
-            user=self.user, course_key=self.course_key, mode="audit",
+        result = CertificateCreationRequested.run_filter(
+            user=self.user,
+            course_key=self.course_key,
+            mode="honor",
+            status="downloadable",
+            grade=1.0,
+            generation_mode="batch",
         )
 
         self.assertTupleEqual(expected_result, result)
 
-    @override_settings(
-        OPEN_EDX_FILTERS_CONFIG={
-            "org.openedx.learning.course.enrollment.started.v1": {
-                "fail_silently": False,
-                "pipeline": [
-                    "openedx_filters_samples.samples.pipeline.StopEnrollment"
-                ]
-            }
-        }
-    )
+    def test_keep_certificate_mode(self):
+        """
+        Test that certificates in modes other than honor keep their mode.
+        """
+        result = CertificateCreationRequested.run_filter(
+            user=self.user,
+            course_key=self.course_key,
+            mode="verified",
+            status="downloadable",
+            grade=1.0,
+            generation_mode="batch",
+        )
+
+        self.assertEqual("verified", result[2])
+
+    def test_filter_enrollment_dashboard(self):
+        """
+        Test that enrollments in edX courses are removed from the dashboard.
+        """
+        edx_enrollment = MagicMock(course_id=CourseKey.from_string("course-v1:edX+DemoX+Demo_Course"))
+        demo_enrollment = MagicMock(course_id=self.course_key)
+        context = {"course_enrollments": [edx_enrollment, demo_enrollment]}
+
+        context, template_name = DashboardRenderStarted.run_filter(context=context, template_name="dashboard.html")
+
+        self.assertListEqual([demo_enrollment], context["course_enrollments"])
+        self.assertEqual("dashboard.html", template_name)
+
+    def test_filter_enrollment_dashboard_queryset(self):
+        """
+        Test that enrollment querysets are filtered by the database.
+        """
+        enrollments = MagicMock(spec=QuerySet)
+        context = {"course_enrollments": enrollments}
+
+        context, template_name = DashboardRenderStarted.run_filter(context=context, template_name="dashboard.html")
+
+        enrollments.exclude.assert_called_once_with(course__org__regex="^edX$")
+        self.assertEqual(enrollments.exclude.return_value, context["course_enrollments"])
+        self.assertEqual("dashboard.html", template_name)
+
+    def test_modify_updates_from_course(self):
+        """
+        Test that the course update message is replaced before rendering the course about page.
+        """
+        update_message = MagicMock(content="<p>Welcome to the course</p>")
+        context = {"update_message_fragment": update_message}
+
+        context, template_name = CourseAboutRenderStarted.run_filter(
+            context=context, template_name="courseware/course_about.html",
+        )
+
+        self.assertEqual("<p>This is a simple message</p>", context["update_message_fragment"].content)
+        self.assertEqual("courseware/course_about.html", template_name)
+
+    def test_staff_view_course_about(self):
+        """
+        Test that the course about page is rendered with staff access.
+        """
+        context = {"update_message_fragment": None}
+
+        context, template_name = CourseAboutRenderStarted.run_filter(
+            context=context, template_name="courseware/course_about.html",
+        )
+
+        self.assertTrue(context["staff_access"])
+        self.assertEqual("http://studio.com", context["studio_url"])
+        self.assertEqual("courseware/course_about.html", template_name)
+
+    def test_filter_course_enrollments_queryset(self):
+        """
+        Test that the enrollments queryset is filtered by the database and stays a queryset.
+        """
+        enrollments = MagicMock(spec=QuerySet)
+        step = CourseEnrollmentsQsPipelineStep("org.openedx.learning.course_enrollment_queryset.requested.v1", [])
+
+        result = step.run_filter(enrollments=enrollments)
+
+        enrollments.exclude.assert_called_once_with(course__org__regex="^edX$")
+        self.assertEqual({"enrollments": enrollments.exclude.return_value}, result)
+
+
+@override_settings(
+    OPEN_EDX_FILTERS_CONFIG={
+        "org.openedx.learning.student.registration.requested.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.StopRegister"
+            ]
+        },
+        "org.openedx.learning.student.login.requested.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.StopLogin"
+            ]
+        },
+        "org.openedx.learning.course.enrollment.started.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.StopEnrollment"
+            ]
+        },
+        "org.openedx.learning.course_about.render.started.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.RenderResponseCourseAbout"
+            ]
+        },
+    }
+)
+class HaltingStepsTestCase(SampleStepsTestCase):
+    """
+    Test cases for the samples steps that halt the process.
+    """
+
+    def test_stop_registration(self):
+        """
+        Test that the user's registration stops.
+        """
+        with self.assertRaises(StudentRegistrationRequested.PreventRegistration):
+            StudentRegistrationRequested.run_filter(form_data=self.registration_form)
+
+    def test_stop_login(self):
+        """
+        Test that the user's login stops.
+        """
+        with self.assertRaises(StudentLoginRequested.PreventLogin):
+            StudentLoginRequested.run_filter(user=self.user)
+
     def test_stop_enrollment(self):
         """
         Test that the user's enrollment stops.
@@ -148,3 +342,105 @@ class SampleStepsTestCase(TestCase):
             CourseEnrollmentStarted.run_filter(
                 user=self.user, course_key=self.course_key, mode="audit",
             )
+
+    def test_render_response_course_about(self):
+        """
+        Test that the course about render stops with a custom response.
+        """
+        with self.assertRaises(CourseAboutRenderStarted.RenderCustomResponse) as context_manager:
+            CourseAboutRenderStarted.run_filter(context={}, template_name="courseware/course_about.html")
+
+        self.assertEqual(b"Here's the text of the web page.", context_manager.exception.response.content)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+    OPEN_EDX_FILTERS_CONFIG={
+        "org.openedx.learning.certificate.render.started.v1": {
+            "fail_silently": False,
+            "pipeline": [
+                "openedx_filters_samples.samples.pipeline.RenderCustomCertificateStep"
+            ]
+        },
+    },
+)
+class CustomCertificateTemplateTestCase(SampleStepsTestCase):
+    """
+    Test cases for the custom certificate template step and its cache.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.context = {"course_id": str(self.course_key)}
+        self.template = SimpleNamespace(course_key=self.course_key, name="custom template")
+        patcher = patch("openedx_filters_samples.samples.pipeline.CertificateTemplate")
+        self.certificate_template = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.certificate_template.MultipleObjectsReturned = MultipleObjectsReturned
+        self.certificate_template.objects.get_or_create.return_value = (self.template, True)
+
+    def test_custom_template_is_created_for_the_course(self):
+        """
+        Test that the custom template is looked up by course and created with the step's defaults.
+        """
+        _, custom_template = CertificateRenderStarted.run_filter(context=self.context, custom_template=None)
+
+        self.assertEqual(self.template, custom_template)
+        self.certificate_template.objects.get_or_create.assert_called_once()
+        lookup = self.certificate_template.objects.get_or_create.call_args.kwargs
+        self.assertEqual({"course_key", "defaults"}, set(lookup))
+        self.assertEqual(self.course_key, lookup["course_key"])
+        self.assertEqual("honor", lookup["defaults"]["mode"])
+
+    def test_custom_template_is_cached(self):
+        """
+        Test that the custom template is read from the cache after the first lookup.
+        """
+        CertificateRenderStarted.run_filter(context=self.context, custom_template=None)
+        _, custom_template = CertificateRenderStarted.run_filter(context=self.context, custom_template=None)
+
+        self.assertEqual(self.template, custom_template)
+        self.certificate_template.objects.get_or_create.assert_called_once()
+
+    def test_custom_template_with_several_course_templates(self):
+        """
+        Test that the first template of the course is used when the course has several.
+        """
+        self.certificate_template.objects.get_or_create.side_effect = MultipleObjectsReturned
+        self.certificate_template.objects.filter.return_value.first.return_value = self.template
+
+        _, custom_template = CertificateRenderStarted.run_filter(context=self.context, custom_template=None)
+
+        self.assertEqual(self.template, custom_template)
+        self.certificate_template.objects.filter.assert_called_once_with(course_key=self.course_key)
+
+    def test_invalidate_custom_template(self):
+        """
+        Test that saving or deleting a template of the course drops the cached one.
+        """
+        CertificateRenderStarted.run_filter(context=self.context, custom_template=None)
+
+        invalidate_custom_template(sender=self.certificate_template, instance=self.template)
+        CertificateRenderStarted.run_filter(context=self.context, custom_template=None)
+
+        self.assertEqual(2, self.certificate_template.objects.get_or_create.call_count)
+
+    def test_invalidate_previous_custom_template(self):
+        """
+        Test that moving a template to another course drops the cached template of its previous course.
+        """
+        CertificateRenderStarted.run_filter(context=self.context, custom_template=None)
+        moved = self.certificate_template.objects.filter.return_value.exclude.return_value
+        moved.values_list.return_value = [self.course_key]
+        instance = SimpleNamespace(pk=1, course_key=CourseKey.from_string("course-v1:Demo+DemoX+Other_Course"))
+
+        invalidate_previous_custom_template(sender=self.certificate_template, instance=instance)
+        CertificateRenderStarted.run_filter(context=self.context, custom_template=None)
+
+        self.certificate_template.objects.filter.assert_called_once_with(pk=1)
+        self.assertEqual(2, self.certificate_template.objects.get_or_create.call_count)
@@ -0,0 +1,47 @@
+"""
+Tests for the `openedx-filters-samples` apps module.
+"""
+from unittest.mock import patch
+
+from django.apps import apps
+from django.test import SimpleTestCase
+
+from openedx_filters_samples.samples.pipeline import invalidate_custom_template, invalidate_previous_custom_template
+
+
+class OpenedxFiltersSamplesConfigTestCase(SimpleTestCase):
+    """
+    App configuration test cases.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.app_config = apps.get_app_config("openedx_filters_samples")
+
+    @patch("openedx_filters_samples.apps.post_delete")
+    @patch("openedx_filters_samples.apps.post_save")
+    @patch("openedx_filters_samples.apps.pre_save")
+    def test_certificate_template_signals_in_lms(self, pre_save, post_save, post_delete):
+        """
+        Test that the custom template cache is invalidated on template changes when certificates is installed.
+        """
+        with patch.object(apps, "is_installed", return_value=True):
+            self.app_config.ready()
+
+        sender = "certificates.CertificateTemplate"
+        pre_save.connect.assert_called_once_with(invalidate_previous_custom_template, sender=sender)
+        post_save.connect.assert_called_once_with(invalidate_custom_template, sender=sender)
+        post_delete.connect.assert_called_once_with(invalidate_custom_template, sender=sender)
+
+    @patch("openedx_filters_samples.apps.post_delete")
+    @patch("openedx_filters_samples.apps.post_save")
+    @patch("openedx_filters_samples.apps.pre_save")
+    def test_certificate_template_signals_outside_lms(self, pre_save, post_save, post_delete):
+        """
+        Test that no certificate template receivers are connected when certificates isn't installed.
+        """
+        self.app_config.ready()
+
+        pre_save.connect.assert_not_called()
+        post_save.connect.assert_not_called()
+        post_delete.connect.assert_not_called()
@@ -0,0 +1,296 @@
+"""
+Tests for the `openedx-filters-samples` bulk module.
+"""
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase
+
+from openedx_filters_samples import bulk
+
+
+class BulkTestCase(TestCase):
+    """
+    Base test case that mocks the profile model and the writer thread.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.profile = MagicMock(user_id=1)
+        self.profile.get_meta.side_effect = lambda: {"language": "en"}
+        self.model = MagicMock()
+        self.model.objects.select_for_update.return_value.filter.return_value = [self.profile]
+        patcher = patch.object(bulk.apps, "get_model", return_value=self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(bulk, "start_profile_writer")
+        self.start_profile_writer = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        super().tearDown()
+        bulk._pending.clear()  # pylint: disable=protected-access
+        bulk._attempts.clear()  # pylint: disable=protected-access
+        bulk._request.updates = None  # pylint: disable=protected-access
+
+    def queue_profile_meta(self, user_id, meta):
+        """
+        Queue a profile meta update and commit it.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.queue_profile_meta(user_id, meta)
+
+
+class FlushProfileMetaTestCase(BulkTestCase):
+    """
+    Profile meta batched writer test cases.
+    """
+
+    def test_flush_without_pending_updates(self):
+        """
+        Test that nothing is written when there are no pending updates.
+        """
+        self.assertEqual(0, bulk.flush_profile_meta())
+
+        self.model.objects.bulk_update.assert_not_called()
+
+    def test_flush_merges_updates_per_profile(self):
+        """
+        Test that pending updates for the same profile are merged into one write.
+        """
+        self.queue_profile_meta(1, {"previous_login": "yesterday"})
+        self.queue_profile_meta(1, {"unenrolled_from": "course-v1:Demo+DemoX+Demo_Course"})
+
+        updated = bulk.flush_profile_meta()
+
+        self.assertEqual(1, updated)
+        self.profile.set_meta.assert_called_once_with(
+            {
+                "language": "en",
+                "previous_login": "yesterday",
+                "unenrolled_from": "course-v1:Demo+DemoX+Demo_Course",
+            }
+        )
+        self.model.objects.bulk_update.assert_called_once_with([self.profile], ["meta"])
+
+    def test_flush_skips_unchanged_profiles(self):
+        """
+        Test that profiles whose meta already holds the queued values are not written.
+        """
+        self.queue_profile_meta(1, {"language": "en"})
+
+        updated = bulk.flush_profile_meta()
+
+        self.assertEqual(0, updated)
+        self.profile.set_meta.assert_not_called()
+        self.model.objects.bulk_update.assert_not_called()
+
+    def test_flush_requeues_locked_profiles(self):
+        """
+        Test that updates for profiles locked by another transaction are retried.
+        """
+        self.model.objects.select_for_update.return_value.filter.return_value = []
+        self.model.objects.filter.return_value.values_list.return_value = [2]
+        self.queue_profile_meta(2, {"previous_login": "yesterday"})
+
+        bulk.flush_profile_meta()
+
+        self.assertEqual({2: {"previous_login": "yesterday"}}, bulk._pending)  # pylint: disable=protected-access
+
+    def test_flush_requeues_failed_batch(self):
+        """
+        Test that a batch whose write fails is queued again.
+        """
+        self.model.objects.bulk_update.side_effect = RuntimeError
+        self.queue_profile_meta(1, {"previous_login": "yesterday"})
+
+        with self.assertRaises(RuntimeError):
+            bulk.flush_profile_meta()
+
+        self.assertEqual({1: {"previous_login": "yesterday"}}, bulk._pending)  # pylint: disable=protected-access
+
+    def test_requeue_keeps_newer_updates(self):
+        """
+        Test that updates queued while a failed batch was being written take precedence over it.
+        """
+        def queue_newer_update(*args):
+            self.queue_profile_meta(1, {"previous_login": "today"})
+            raise RuntimeError
+
+        self.model.objects.bulk_update.side_effect = queue_newer_update
+        self.queue_profile_meta(1, {"previous_login": "yesterday", "cohort_info": "Default Group"})
+
+        with self.assertRaises(RuntimeError):
+            bulk.flush_profile_meta()
+
+        self.assertEqual(
+            {1: {"previous_login": "today", "cohort_info": "Default Group"}},
+            bulk._pending,  # pylint: disable=protected-access
+        )
+
+    def test_rolled_back_updates_are_discarded(self):
+        """
+        Test that updates are not queued until their transaction commits.
+        """
+        with self.captureOnCommitCallbacks() as callbacks:
+            bulk.queue_profile_meta(1, {"previous_login": "yesterday"})
+
+        self.assertEqual(1, len(callbacks))
+        self.assertEqual({}, bulk._pending)  # pylint: disable=protected-access
+        self.start_profile_writer.assert_not_called()
+
+
+class RequestProfileMetaTestCase(BulkTestCase):
+    """
+    Profile meta updates queued while serving a request test cases.
+    """
+
+    def setUp(self):
+        super().setUp()
+        bulk.buffer_profile_meta_on_request_started(sender=None)
+
+    def test_request_updates_are_written_when_it_finishes(self):
+        """
+        Test that the updates queued by a request are written together once it finishes.
+        """
+        profile = MagicMock(user_id=2)
+        profile.get_meta.return_value = {}
+        self.model.objects.select_for_update.return_value.filter.return_value = [self.profile, profile]
+        self.queue_profile_meta(1, {"previous_login": "yesterday"})
+        self.queue_profile_meta(2, {"unenrolled_from": "course-v1:Demo+DemoX+Demo_Course"})
+
+        self.model.objects.bulk_update.assert_not_called()
+        bulk.flush_profile_meta_on_request_finished(sender=None)
+
+        self.model.objects.bulk_update.assert_called_once_with([self.profile, profile], ["meta"])
+        self.assertEqual({}, bulk._pending)  # pylint: disable=protected-access
+        self.start_profile_writer.assert_not_called()
+
+    def test_request_finished_flush_logs_errors(self):
+        """
+        Test that a failed flush at the end of a request is logged and left to the writer thread.
+        """
+        self.model.objects.bulk_update.side_effect = RuntimeError
+        self.queue_profile_meta(1, {"previous_login": "yesterday"})
+
+        with self.assertLogs(bulk.log, level="ERROR"):
+            bulk.flush_profile_meta_on_request_finished(sender=None)
+
+        self.assertEqual({1: {"previous_login": "yesterday"}}, bulk._pending)  # pylint: disable=protected-access
+        self.start_profile_writer.assert_called_once_with()
+
+
+@patch.object(bulk, "MAX_RETRY_DELAY", 0)
+@patch.object(bulk, "WRITER_IDLE_TIMEOUT", 0.01)
+@patch.object(bulk, "FLUSH_INTERVAL", 0)
+class ProfileWriterTestCase(BulkTestCase):
+    """
+    Background profile meta writer test cases.
+
+    The writer loop runs in the test thread and returns once it has been idle
+    for `WRITER_IDLE_TIMEOUT` seconds.
+    """
+
+    def test_writer_exits_when_idle(self):
+        """
+        Test that the writer stops and clears itself when there is nothing to write.
+        """
+        bulk._run_writer()  # pylint: disable=protected-access
+
+        self.assertIsNone(bulk._writer)  # pylint: disable=protected-access
+        self.model.objects.bulk_update.assert_not_called()
+
+    def test_writer_writes_pending_updates(self):
+        """
+        Test that the writer persists the pending updates before exiting.
+        """
+        self.queue_profile_meta(1, {"previous_login": "yesterday"})
+
+        bulk._run_writer()  # pylint: disable=protected-access
+
+        self.model.objects.bulk_update.assert_called_once_with([self.profile], ["meta"])
+        self.assertEqual({}, bulk._pending)  # pylint: disable=protected-access
+
+    @patch.object(bulk, "_write_profile_meta", side_effect=RuntimeError)
+    def test_writer_drops_updates_after_max_attempts(self, write_profile_meta):
+        """
+        Test that an update that keeps failing is retried up to MAX_ATTEMPTS times and then dropped.
+        """
+        self.queue_profile_meta(1, {"previous_login": "yesterday"})
+
+        with self.assertLogs(bulk.log, level="ERROR") as logs:
+            bulk._run_writer()  # pylint: disable=protected-access
+
+        self.assertEqual(bulk.MAX_ATTEMPTS, write_profile_meta.call_count)
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual({}, bulk._pending)  # pylint: disable=protected-access
+        self.assertEqual({}, bulk._attempts)  # pylint: disable=protected-access
+
+    def test_writer_isolates_failing_updates(self):
+        """
+        Test that a failing update doesn't keep the rest of its batch from being written.
+        """
+        written = []
+
+        def write_profile_meta(updates):
+            if 2 in updates:
+                raise RuntimeError
+            written.extend(updates)
+
+        self.queue_profile_meta(1, {"previous_login": "yesterday"})
+        self.queue_profile_meta(2, {"previous_login": "yesterday"})
+
+        with patch.object(bulk, "_write_profile_meta", side_effect=write_profile_meta):
+            with self.assertLogs(bulk.log, level="ERROR"):
+                bulk._run_writer()  # pylint: disable=protected-access
+
+        self.assertEqual([1], written)
+        self.assertEqual({}, bulk._pending)  # pylint: disable=protected-access
+
+    def test_writer_retries_failed_updates(self):
+        """
+        Test that an update whose write fails is written on a later attempt.
+        """
+        self.model.objects.bulk_update.side_effect = [RuntimeError, None]
+        self.queue_profile_meta(1, {"previous_login": "yesterday"})
+
+        bulk._run_writer()  # pylint: disable=protected-access
+
+        self.assertEqual(2, self.model.objects.bulk_update.call_count)
+        self.assertEqual({}, bulk._attempts)  # pylint: disable=protected-access
+
+
+class StartProfileWriterTestCase(TestCase):
+    """
+    Profile meta writer thread start test cases.
+    """
+
+    def tearDown(self):
+        super().tearDown()
+        bulk._writer = None  # pylint: disable=protected-access
+
+    @patch.object(bulk.threading, "Thread")
+    def test_start_profile_writer_once(self, thread):
+        """
+        Test that a single writer thread is started while it is alive.
+        """
+        thread.return_value.is_alive.return_value = True
+
+        bulk.start_profile_writer()
+        bulk.start_profile_writer()
+
+        thread.assert_called_once_with(
+            target=bulk._run_writer, name="profile-meta-writer", daemon=True,  # pylint: disable=protected-access
+        )
+        thread.return_value.start.assert_called_once_with()
+
+    @patch.object(bulk.threading, "Thread")
+    def test_restart_dead_profile_writer(self, thread):
+        """
+        Test that the writer thread is started again once it is no longer alive, e.g. after a fork.
+        """
+        thread.return_value.is_alive.return_value = False
+
+        bulk.start_profile_writer()
+        bulk.start_profile_writer()
+
+        self.assertEqual(2, thread.return_value.start.call_count)